@@ -1,44 +1,86 @@
-from fastapi import FastAPI
+import asyncio
+import functools
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 import chromadb
+import chromadb.errors
 from chromadb.config import Settings
-import hashlib
+from chromadb.utils import embedding_functions
+import onnxruntime
 from datetime import datetime
 import os
+import sys
 import json
+import orjson
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
 from dotenv import load_dotenv
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from openai import OpenAI
+from semantic_text_splitter import TextSplitter
+from fastembed.rerank.cross_encoder import TextCrossEncoder
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+import httpx
 
 # 加载环境变量
 load_dotenv()
 
-# LLM客户端（支持热重载）
-def get_llm_client():
-    """获取LLM客户端（每次重新读取配置）"""
-    # 重新加载环境变量
-    load_dotenv(override=True)
+def get_env_file_path():
+    """获取.env文件路径"""
+    return os.path.join(os.path.dirname(__file__), '..', '.env')
+
+@functools.lru_cache(maxsize=4)
+def build_llm_client(api_key, base_url):
+    """按 (api_key, base_url) 复用 LLM 客户端，使 HTTPS 连接在请求之间保持复用"""
+    return AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60)
+        )
+    )
+
+# LLM 配置缓存 - 仅在 .env 被修改后重新加载
+_config_cache = {"client": None, "model": None, "mtime": 0}
+
+def load_llm_config():
+    """按 .env 的修改时间刷新 LLM 配置缓存（支持热重载）"""
+    env_path = get_env_file_path()
+    mtime = os.stat(env_path).st_mtime if os.path.exists(env_path) else None
     
-    api_key = os.getenv("LLM_API_KEY", "")
-    base_url = os.getenv("LLM_BASE_URL", "https://api.openai.com/v1")
+    if mtime != _config_cache["mtime"]:
+        # 配置文件有变化，重新加载环境变量
+        load_dotenv(env_path, override=True)
+        
+        api_key = os.getenv("LLM_API_KEY", "")
+        base_url = os.getenv("LLM_BASE_URL", "https://api.openai.com/v1")
+        
+        _config_cache["client"] = build_llm_client(api_key, base_url) if api_key else None
+        _config_cache["model"] = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+        _config_cache["mtime"] = mtime
     
-    if api_key:
-        return OpenAI(api_key=api_key, base_url=base_url)
-    return None
+    return _config_cache
+
+def invalidate_llm_config():
+    """使 LLM 配置缓存失效，下次请求时重新读取 .env"""
+    _config_cache["mtime"] = 0
+
+# LLM客户端（支持热重载）
+def get_llm_client():
+    """获取LLM客户端（配置未变化时复用缓存）"""
+    return load_llm_config()["client"]
 
 def get_llm_model():
     """获取当前配置的模型名称"""
-    load_dotenv(override=True)
-    return os.getenv("LLM_MODEL", "gpt-3.5-turbo")
-
-# 初始化文本分块器
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1000,
-    chunk_overlap=200,
-    length_function=len,
-    is_separator_regex=False,
-)
+    return load_llm_config()["model"]
+
+# 初始化文本分块器（Rust 实现，按字符数计算块大小）
+# 约 100 token 一块（中英文混合约 400 字符）、不重叠：检索精度更高，且无重复内容需要向量化
+text_splitter = TextSplitter(capacity=400, overlap=0)
 
 # 创建 FastAPI 应用实例
 app = FastAPI(title="Web-Retrace API", version="3.0.0")
@@ -52,21 +94,359 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 初始化 ChromaDB 客户端和集合
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
-collection = chroma_client.get_or_create_collection(
-    name="web_pages",
-    metadata={"description": "Stores web page content for RAG retrieval"}
+# 请求体解压 - 允许客户端以 Content-Encoding: gzip 上传较大的页面内容
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+
+class GZipRequestMiddleware:
+    """解压 gzip 编码的请求体（限制解压后的大小，防止压缩炸弹）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope["headers"]) if scope["type"] == "http" else {}
+        if headers.get(b"content-encoding", b"").lower() != b"gzip":
+            await self.app(scope, receive, send)
+            return
+        
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if len(body) > MAX_REQUEST_BYTES:
+                # 压缩后的数据已超过上限，无需读完
+                await PlainTextResponse("请求体过大", status_code=413)(scope, receive, send)
+                return
+        
+        try:
+            decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+            body = decompressor.decompress(body, MAX_REQUEST_BYTES + 1)
+        except zlib.error:
+            await PlainTextResponse("无效的 gzip 请求体", status_code=400)(scope, receive, send)
+            return
+        if len(body) > MAX_REQUEST_BYTES or decompressor.unconsumed_tail:
+            await PlainTextResponse("请求体过大", status_code=413)(scope, receive, send)
+            return
+        
+        scope = dict(scope, headers=[
+            (key, value) for key, value in scope["headers"]
+            if key not in (b"content-encoding", b"content-length")
+        ] + [(b"content-length", str(len(body)).encode())])
+        
+        body_sent = False
+        async def receive_decompressed():
+            nonlocal body_sent
+            if body_sent:
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        
+        await self.app(scope, receive_decompressed, send)
+
+app.add_middleware(GZipRequestMiddleware)
+
+# 向量推理后端优先级 - 有 GPU 时优先使用，否则回退到 CPU（可用 EMBEDDING_PROVIDERS 环境变量覆盖）
+EMBEDDING_PROVIDERS = (
+    "CUDAExecutionProvider",
+    "DmlExecutionProvider",
+    "CoreMLExecutionProvider",
+    "CPUExecutionProvider",
 )
 
+def build_embedder():
+    """创建与 Chroma 默认模型相同的 MiniLM ONNX 向量模型，并选择本机可用的推理后端"""
+    configured = os.getenv("EMBEDDING_PROVIDERS")
+    candidates = [p.strip() for p in configured.split(",")] if configured else EMBEDDING_PROVIDERS
+    available = set(onnxruntime.get_available_providers())
+    providers = [p for p in candidates if p in available]
+    return embedding_functions.ONNXMiniLM_L6_V2(preferred_providers=providers or None)
+
+# 向量模型 - 集合绑定 Chroma 默认模型；写入与查询的向量由 embedder 预先计算，
+# 两者权重相同，向量空间与已存储的数据保持一致
+embedding_function = embedding_functions.DefaultEmbeddingFunction()
+embedder = build_embedder()
+EMBED_BATCH_SIZE = 64
+ADD_BATCH_SIZE = 250  # ChromaDB 建议的单次写入规模 50-250
+
+# 页面大小限制 - 超过上限直接拒绝；长页面按窗口分段拆分
+MAX_CONTENT_CHARS = 2_000_000
+SPLIT_WINDOW_CHARS = 100_000
+
+@functools.lru_cache(maxsize=1024)
+def embed_query(text):
+    """计算查询向量（按原文缓存，重复提问无需再次推理）"""
+    return tuple(float(x) for x in embedder([text])[0])
+
+# 检索参数 - 先多召回候选，再用交叉编码器重排序取前几条交给 LLM
+RETRIEVE_CANDIDATES = 30
+RERANK_TOP_K = 5
+
+# 重排序模型加载失败（如离线无法下载）后，在此时间内不再重试，直接使用向量检索顺序
+RERANKER_RETRY_SECONDS = 600
+
+_reranker = None
+_reranker_failed_at = None
+_reranker_lock = threading.Lock()
+
+def get_reranker():
+    """
+    懒加载交叉编码器重排序模型（首次使用时下载，ONNX 推理）
+    
+    Returns:
+        模型实例；正在被其他线程加载、或最近一次加载失败时返回 None（调用方跳过重排序）
+    """
+    global _reranker, _reranker_failed_at
+    if _reranker is not None:
+        return _reranker
+    if _reranker_failed_at is not None and time.monotonic() - _reranker_failed_at < RERANKER_RETRY_SECONDS:
+        return None
+    # 下载可能耗时数十秒：其他请求不排队等待，本次直接跳过重排序
+    if not _reranker_lock.acquire(blocking=False):
+        return None
+    try:
+        if _reranker is None:
+            _reranker = TextCrossEncoder(model_name="Xenova/ms-marco-MiniLM-L-6-v2")
+            _reranker_failed_at = None
+    except Exception as e:
+        _reranker_failed_at = time.monotonic()
+        print(f"⚠️ 重排序模型加载失败，{RERANKER_RETRY_SECONDS} 秒内直接使用向量检索顺序: {e}")
+    finally:
+        _reranker_lock.release()
+    return _reranker
+
+# 启动时在后台预加载重排序模型，首个聊天请求无需等待下载
+threading.Thread(target=get_reranker, daemon=True).start()
+
+def rerank_results(query, results, top_k=RERANK_TOP_K):
+    """对 collection.query 的结果重排序，返回同样结构的前 top_k 条（模型不可用时保留向量检索顺序）"""
+    documents = results['documents'][0]
+    reranker = get_reranker()
+    order = range(min(top_k, len(documents)))
+    if reranker is not None:
+        try:
+            scores = list(reranker.rerank(query, documents))
+            order = sorted(range(len(documents)), key=scores.__getitem__, reverse=True)[:top_k]
+        except Exception as e:
+            print(f"⚠️ 重排序失败，使用向量检索顺序: {e}")
+    return {
+        key: [[results[key][0][i] for i in order]]
+        for key in ('ids', 'documents', 'metadatas')
+    }
+
+# 初始化 ChromaDB 客户端和集合
+# 设置 CHROMA_HOST 时连接独立的 Chroma 服务端（多进程部署必需），否则使用本地持久化存储
+if os.getenv("CHROMA_HOST"):
+    chroma_client = chromadb.HttpClient(
+        host=os.getenv("CHROMA_HOST"),
+        port=int(os.getenv("CHROMA_PORT", "8001"))
+    )
+else:
+    chroma_client = chromadb.PersistentClient(path="./chroma_db")
+
+# 集合不存在时各版本 Chroma 抛出的异常（1.x 为 NotFoundError，0.6 为 InvalidCollectionException，更早为 ValueError）
+COLLECTION_NOT_FOUND = tuple(
+    getattr(chromadb.errors, name)
+    for name in ("NotFoundError", "InvalidCollectionException")
+    if hasattr(chromadb.errors, name)
+) + (ValueError,)
+
+def open_collection():
+    """获取 web_pages 集合，不存在时创建"""
+    try:
+        # 已有集合沿用创建时的 HNSW 参数（Chroma 不支持修改距离函数）
+        return chroma_client.get_collection(
+            name="web_pages",
+            embedding_function=embedding_function
+        )
+    except COLLECTION_NOT_FOUND:
+        pass
+    
+    try:
+        # 新建集合时调优 HNSW 索引：以写入为主、偶尔查询、百万级以内向量
+        return chroma_client.create_collection(
+            name="web_pages",
+            embedding_function=embedding_function,
+            metadata={
+                "description": "Stores web page content for RAG retrieval",
+                "hnsw:space": "cosine",
+                "hnsw:construction_ef": 100,
+                "hnsw:M": 16,
+                "hnsw:search_ef": 64
+            }
+        )
+    except Exception as create_error:
+        # 多进程同时启动时集合可能刚被其他进程创建，重新获取；仍不存在则抛出创建时的错误
+        try:
+            return chroma_client.get_collection(
+                name="web_pages",
+                embedding_function=embedding_function
+            )
+        except COLLECTION_NOT_FOUND:
+            raise create_error
+
+collection = open_collection()
+
+# 文本块数量缓存 - 避免每个请求都查询 SQLite
+class CountCache:
+    """缓存 collection.count() 结果，超过 TTL 后在后台刷新（count 在线程池中执行，不阻塞事件循环）"""
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._n = None
+        self._t = 0
+        self._version = 0  # 每次 add() 递增，用于丢弃与写入重叠的刷新结果
+        self._refresh_task = None
+
+    async def get(self):
+        if not self._n:
+            # 尚无缓存，或缓存为 0：不信任 0（多进程时其他进程可能已写入），每次实时查询
+            await self._refresh()
+        elif time.monotonic() - self._t > self.ttl and self._refresh_task is None:
+            # 已过期：先返回旧值，同时在后台刷新
+            self._refresh_task = asyncio.create_task(self._refresh_in_background())
+        return self._n
+
+    async def _refresh(self):
+        version = self._version
+        n = await asyncio.to_thread(collection.count)
+        if version != self._version and self._n is not None:
+            # 查询期间有 add() 更新了计数，查询结果可能更旧，保留当前值
+            return
+        self._n = n
+        self._t = time.monotonic()
+
+    async def _refresh_in_background(self):
+        try:
+            await self._refresh()
+        except Exception:
+            # 刷新失败时保留旧值，下次调用再重试
+            pass
+        finally:
+            self._refresh_task = None
+
+    def add(self, n):
+        """写入成功（或回滚）后同步调整计数"""
+        self._version += 1
+        if self._n is not None:
+            self._n += n
+
+count_cache = CountCache()
+
+# LLM 回答缓存 - 相同问题检索到相同文本块时直接复用回答
+class AnswerCache:
+    """LRU 缓存，键为 (模式, 模型, 问题, 检索到的文本块 ID)"""
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    @staticmethod
+    def key(mode, model, message, doc_ids):
+        return (mode, model, message, tuple(sorted(doc_ids)))
+
+    def get(self, key):
+        answer = self._data.get(key)
+        if answer is not None:
+            self._data.move_to_end(key)
+        return answer
+
+    def set(self, key, answer):
+        if not answer:
+            return
+        self._data[key] = answer
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+answer_cache = AnswerCache()
+
+# 页面索引 - 与 ChromaDB 并存的 SQLite 表，列出页面时无需扫描全部文本块
+os.makedirs("./chroma_db", exist_ok=True)
+pages_db = sqlite3.connect("./chroma_db/pages_index.sqlite", check_same_thread=False)
+pages_db.row_factory = sqlite3.Row
+pages_db_lock = threading.Lock()
+pages_db.execute("PRAGMA journal_mode=WAL")
+pages_db.execute("PRAGMA synchronous=NORMAL")
+pages_db.execute("PRAGMA temp_store=MEMORY")
+with pages_db:
+    pages_db.execute(
+        "CREATE TABLE IF NOT EXISTS pages ("
+        "id TEXT PRIMARY KEY, title TEXT, timestamp INTEGER, chunks INTEGER, preview TEXT)"
+    )
+    pages_db.execute("CREATE INDEX IF NOT EXISTS idx_pages_timestamp ON pages (timestamp)")
+
+def timestamp_to_ns(value):
+    """将时间戳统一为纳秒整数（兼容旧版本存储的 ISO 字符串）"""
+    if isinstance(value, str):
+        return int(datetime.fromisoformat(value).timestamp() * 1_000_000_000) if value else 0
+    return int(value or 0)
+
+def format_timestamp(value):
+    """返回给客户端前将纳秒时间戳转为 ISO 字符串"""
+    if isinstance(value, str):
+        return value
+    return datetime.fromtimestamp(value / 1_000_000_000).isoformat() if value else ''
+
+def index_pages(rows):
+    """在一个事务内写入 (id, title, timestamp, chunks, preview) 记录"""
+    with pages_db_lock, pages_db:
+        pages_db.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)", rows)
+
+def list_indexed_pages():
+    """按时间倒序列出页面索引"""
+    with pages_db_lock:
+        rows = pages_db.execute(
+            "SELECT id, title, timestamp, chunks, preview FROM pages ORDER BY timestamp DESC"
+        ).fetchall()
+    return [{**row, "timestamp": format_timestamp(row["timestamp"])} for row in map(dict, rows)]
+
+def rebuild_pages_index():
+    """索引为空但集合中已有数据时（旧版本升级），从所有文本块重建页面索引"""
+    with pages_db_lock:
+        indexed = pages_db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+    if indexed or collection.count() == 0:
+        return
+    
+    results = collection.get(include=["documents", "metadatas"])
+    
+    # 按source_id分组统计
+    pages_dict = {}
+    for doc, metadata in zip(results['documents'], results['metadatas']):
+        source_id = metadata.get('source_id', 'unknown')
+        
+        if source_id not in pages_dict:
+            pages_dict[source_id] = {
+                'title': metadata.get('title', '未知标题'),
+                'timestamp': timestamp_to_ns(metadata.get('timestamp')),
+                'chunks': 0,
+                'preview': ''
+            }
+        page = pages_dict[source_id]
+        page['chunks'] += 1
+        if doc and (not page['preview'] or metadata.get('chunk_index') == 0):
+            page['preview'] = doc[:200]
+    
+    index_pages([
+        (source_id, page['title'], page['timestamp'], page['chunks'], page['preview'])
+        for source_id, page in pages_dict.items()
+    ])
+
+rebuild_pages_index()
+
 # 定义请求模型
 class ChatRequest(BaseModel):
     message: str
+    stream: bool = False  # 为 True 时以 SSE 流式返回回答
 
 class MemorizeRequest(BaseModel):
     title: str
     content: str
 
+class MemorizeBatchRequest(BaseModel):
+    pages: list[MemorizeRequest]
+
 # 定义响应模型
 class ChatResponse(BaseModel):
     response: str
@@ -78,6 +458,10 @@ class MemorizeResponse(BaseModel):
     title: str
     message: str
 
+class MemorizeBatchResponse(BaseModel):
+    status: str
+    results: list[MemorizeResponse]
+
 class SettingsRequest(BaseModel):
     api_key: str
     base_url: str = "https://api.siliconflow.cn/v1"
@@ -86,7 +470,7 @@ class SettingsRequest(BaseModel):
 # 辅助函数：读写.env文件
 def read_env_file():
     """读取.env文件内容"""
-    env_path = os.path.join(os.path.dirname(__file__), '..', '.env')
+    env_path = get_env_file_path()
     env_vars = {}
     if os.path.exists(env_path):
         with open(env_path, 'r', encoding='utf-8') as f:
@@ -99,7 +483,7 @@ def read_env_file():
 
 def write_env_file(settings):
     """写入设置到.env文件"""
-    env_path = os.path.join(os.path.dirname(__file__), '..', '.env')
+    env_path = get_env_file_path()
     with open(env_path, 'w', encoding='utf-8') as f:
         f.write(f"# LLM API Configuration\n")
         f.write(f"# 由桌面客户端自动生成\n\n")
@@ -116,15 +500,18 @@ def read_all_configs():
     """读取所有API配置"""
     config_path = get_configs_file_path()
     if os.path.exists(config_path):
-        with open(config_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(config_path, 'rb') as f:
+            return orjson.loads(f.read())
     return {"configs": [], "active_config_id": None}
 
 def write_all_configs(data):
     """保存所有配置到JSON文件"""
     config_path = get_configs_file_path()
-    with open(config_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    # 先写临时文件再原子替换，避免写入中途崩溃导致配置损坏
+    tmp_path = config_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_path, config_path)
     
     # 同时更新.env文件为当前激活的配置
     if data.get('active_config_id') and data.get('configs'):
@@ -145,13 +532,190 @@ def write_all_configs(data):
 async def root():
     """根路径 - 健康检查"""
     # 获取集合统计信息
-    count = collection.count()
+    count = await count_cache.get()
     return {
         "message": "Web-Retrace API 正在运行",
         "version": "2.0.0",
         "stored_pages": count
     }
 
+def new_source_id():
+    """生成按时间递增的文档ID（UUIDv7 布局，32 位十六进制）"""
+    if hasattr(uuid, "uuid7"):
+        return uuid.uuid7().hex
+    # Python 3.14 之前没有 uuid.uuid7，按 RFC 9562 手动拼装
+    unix_ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (unix_ms & ((1 << 48) - 1)) << 80  # 48 位毫秒时间戳
+    value |= 0x7 << 76                          # 版本号 7
+    value |= (rand >> 68) << 64                 # 12 位随机数
+    value |= 0b10 << 62                         # RFC 9562 变体
+    value |= rand & ((1 << 62) - 1)             # 62 位随机数
+    return f"{value:032x}"
+
+def new_page_metadata(page):
+    """生成页面级元数据：按时间排序的 UUIDv7 源文档ID 与纳秒时间戳"""
+    return {
+        "title": page.title,
+        "source_id": new_source_id(),
+        "timestamp": time.time_ns()
+    }
+
+def prepare_chunks(base_metadata, chunks, offset=0):
+    """为一段连续的 chunk 生成唯一 ID 与完整元数据（共享同一份页面级字段）"""
+    source_id = base_metadata["source_id"]
+    indices = range(offset, offset + len(chunks))
+    chunk_ids = [f"{source_id}_chunk_{i}" for i in indices]
+    chunk_metadatas = [{**base_metadata, "chunk_index": i} for i in indices]
+    return chunk_ids, chunk_metadatas
+
+def iter_content_windows(content, window=SPLIT_WINDOW_CHARS):
+    """将超长内容切成若干窗口（尽量在换行处断开），逐段交给分块器以限制峰值内存"""
+    start = 0
+    while start < len(content):
+        end = start + window
+        if end < len(content):
+            cut = content.rfind("\n", start + window // 2, end)
+            if cut != -1:
+                end = cut + 1
+        yield content[start:end]
+        start = end
+
+def check_content_size(pages):
+    """拒绝超过 MAX_CONTENT_CHARS 的页面"""
+    for page in pages:
+        if len(page.content) > MAX_CONTENT_CHARS:
+            raise HTTPException(
+                status_code=413,
+                detail=f"页面内容过长: {page.title} ({len(page.content)} 字符，上限 {MAX_CONTENT_CHARS})"
+            )
+
+async def store_pages(pages):
+    """
+    拆分多个页面并写入 ChromaDB
+    
+    写入分为三个并发阶段，通过 asyncio.Queue 衔接：
+    拆分 -> 批量计算向量（每批 EMBED_BATCH_SIZE）-> 批量写入（每批 ADD_BATCH_SIZE），
+    向量计算与 SQLite 写入可以相互重叠。
+    
+    Returns:
+        每个页面对应的 (source_id, chunk 数量) 列表
+    
+    任一阶段失败时删除本次已写入的文本块后再抛出异常，保证集合与页面索引一致。
+    """
+    splits_q = asyncio.Queue(maxsize=EMBED_BATCH_SIZE * 4)
+    embed_q = asyncio.Queue(maxsize=4)
+    index_rows = []
+    stored = []
+    written_ids = []   # 已提交写入的 ID（在发起写入前记录，回滚时一并删除）
+    pending_adds = []  # 仍在线程池中执行的写入，回滚前需等待其结束
+    counted = 0
+    
+    async def split_worker():
+        for page in pages:
+            base_metadata = new_page_metadata(page)
+            chunk_count = 0
+            preview = ""
+            
+            # 按窗口逐段拆分，队列满时等待下游，内存占用只与窗口大小相关
+            for window in iter_content_windows(page.content):
+                chunks = await asyncio.to_thread(text_splitter.chunks, window)
+                chunk_ids, chunk_metadatas = prepare_chunks(base_metadata, chunks, chunk_count)
+                if chunks and not chunk_count:
+                    preview = chunks[0][:200]
+                chunk_count += len(chunks)
+                for record in zip(chunk_ids, chunks, chunk_metadatas):
+                    await splits_q.put(record)
+            
+            stored.append((base_metadata["source_id"], chunk_count))
+            if chunk_count:
+                index_rows.append((
+                    base_metadata["source_id"], page.title, base_metadata["timestamp"], chunk_count, preview
+                ))
+        await splits_q.put(None)
+    
+    async def embed_worker():
+        done = False
+        while not done:
+            # 等待第一条，再取出队列中已就绪的记录凑成一批
+            batch = [await splits_q.get()]
+            while len(batch) < EMBED_BATCH_SIZE and not splits_q.empty():
+                batch.append(splits_q.get_nowait())
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+            if batch:
+                ids, documents, metadatas = (list(column) for column in zip(*batch))
+                embeddings = await asyncio.to_thread(embedder, documents)
+                await embed_q.put((ids, documents, list(embeddings), metadatas))
+        await embed_q.put(None)
+    
+    async def add_worker():
+        nonlocal counted
+        ids, documents, embeddings, metadatas = [], [], [], []
+        while True:
+            item = await embed_q.get()
+            if item is not None:
+                ids.extend(item[0])
+                documents.extend(item[1])
+                embeddings.extend(item[2])
+                metadatas.extend(item[3])
+            if ids and (item is None or len(ids) >= ADD_BATCH_SIZE):
+                # 批量存储 chunks 到 ChromaDB（在线程池中执行，避免阻塞事件循环）
+                # 取消任务无法中止已在线程中运行的写入：用 shield 保留句柄，回滚时等它完成
+                written_ids.extend(ids)
+                add = asyncio.ensure_future(asyncio.to_thread(
+                    collection.add,
+                    ids=ids,
+                    documents=documents,
+                    embeddings=embeddings,
+                    metadatas=metadatas
+                ))
+                pending_adds.append(add)
+                await asyncio.shield(add)
+                pending_adds.remove(add)
+                count_cache.add(len(ids))
+                counted += len(ids)
+                ids, documents, embeddings, metadatas = [], [], [], []
+            if item is None:
+                break
+    
+    tasks = [asyncio.create_task(worker()) for worker in (split_worker, embed_worker, add_worker)]
+    try:
+        await asyncio.gather(*tasks)
+        
+        # 同步更新页面索引
+        if index_rows:
+            await asyncio.to_thread(index_pages, index_rows)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        # 等所有阶段退出、线程中的写入全部结束后再回滚，避免删除之后又有文本块写入
+        await asyncio.gather(*tasks, *pending_adds, return_exceptions=True)
+        if written_ids:
+            # 回滚已写入的文本块，避免它们能被检索到却不出现在页面索引中
+            await asyncio.to_thread(collection.delete, ids=written_ids)
+            count_cache.add(-counted)
+        raise
+    
+    return stored
+
+def memorize_result(page, source_id, chunk_count):
+    """根据拆分结果生成单个页面的存储响应（内容为空、未产生文本块的页面视为失败）"""
+    if not chunk_count:
+        return MemorizeResponse(
+            status="error",
+            doc_id="",
+            title=page.title,
+            message="存储失败: 页面内容为空，没有可存储的文本"
+        )
+    return MemorizeResponse(
+        status="success",
+        doc_id=source_id,
+        title=page.title,
+        message=f"成功存储页面: {page.title} (拆分为 {chunk_count} 个文本块)"
+    )
+
 @app.post("/memorize", response_model=MemorizeResponse)
 async def memorize(request: MemorizeRequest):
     """
@@ -163,47 +727,12 @@ async def memorize(request: MemorizeRequest):
     Returns:
         包含存储状态和文档ID的响应体
     """
+    check_content_size([request])
+    
     try:
-        # 生成唯一的源文档ID（使用标题+时间戳的哈希）
-        timestamp = datetime.now().isoformat()
-        source_id = hashlib.md5(f"{request.title}{timestamp}".encode()).hexdigest()
-        
-        # 使用文本分块器拆分内容
-        chunks = text_splitter.split_text(request.content)
-        
-        # 准备批量存储数据
-        chunk_ids = []
-        chunk_documents = []
-        chunk_metadatas = []
-        
-        for i, chunk in enumerate(chunks):
-            # 为每个 chunk 生成唯一 ID
-            chunk_id = f"{source_id}_chunk_{i}"
-            chunk_ids.append(chunk_id)
-            chunk_documents.append(chunk)
-            
-            # 为每个 chunk 添加完整的元数据
-            chunk_metadatas.append({
-                "title": request.title,
-                "source_id": source_id,
-                "chunk_index": i,
-                "total_chunks": len(chunks),
-                "timestamp": timestamp
-            })
+        [(source_id, chunk_count)] = await store_pages([request])
         
-        # 批量存储所有 chunks 到 ChromaDB
-        collection.add(
-            documents=chunk_documents,
-            metadatas=chunk_metadatas,
-            ids=chunk_ids
-        )
-        
-        return MemorizeResponse(
-            status="success",
-            doc_id=source_id,
-            title=request.title,
-            message=f"成功存储页面: {request.title} (拆分为 {len(chunks)} 个文本块)"
-        )
+        return memorize_result(request, source_id, chunk_count)
     
     except Exception as e:
         return MemorizeResponse(
@@ -213,6 +742,82 @@ async def memorize(request: MemorizeRequest):
             message=f"存储失败: {str(e)}"
         )
 
+@app.post("/memorize-batch", response_model=MemorizeBatchResponse)
+async def memorize_batch(request: MemorizeBatchRequest):
+    """
+    批量记忆端点 - 一次请求存储多个页面
+    
+    Args:
+        request: 包含多个页面标题和内容的请求体
+    
+    Returns:
+        包含每个页面存储结果的响应体
+    """
+    check_content_size(request.pages)
+    
+    try:
+        stored = await store_pages(request.pages)
+        
+        results = [
+            memorize_result(page, source_id, chunk_count)
+            for page, (source_id, chunk_count) in zip(request.pages, stored)
+        ]
+        # 全部成功为 success，全部失败为 error，否则为 partial
+        succeeded = sum(result.status == "success" for result in results)
+        status = "success" if succeeded == len(results) else "error" if not succeeded else "partial"
+        return MemorizeBatchResponse(status=status, results=results)
+    
+    except Exception as e:
+        results = [
+            MemorizeResponse(
+                status="error",
+                doc_id="",
+                title=page.title,
+                message=f"存储失败: {str(e)}"
+            )
+            for page in request.pages
+        ]
+        return MemorizeBatchResponse(status="error", results=results)
+
+def format_snippets(documents, metadatas, trunc=150):
+    """将检索结果格式化为带编号的片段列表（未使用 LLM 时展示）"""
+    return "".join(
+        f"📄 {i}. {metadata.get('title', '未知标题')}\n"
+        f"{doc[:trunc] + '...' if len(doc) > trunc else doc}\n\n"
+        for i, (doc, metadata) in enumerate(zip(documents, metadatas), 1)
+    )
+
+def sse_event(payload):
+    """格式化一条 Server-Sent Events 消息"""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def chat_reply(request, response, status):
+    """按请求模式返回完整的 JSON 响应，或只含一条消息的 SSE 流"""
+    if not request.stream:
+        return ChatResponse(response=response, status=status)
+    
+    async def events():
+        yield sse_event({"delta": response})
+        yield sse_event({"done": True, "status": status})
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+def stream_completion(completion, cache_key):
+    """将 LLM 的流式输出逐块转发为 SSE 响应，完整回答写入回答缓存"""
+    async def events():
+        parts = []
+        try:
+            async for chunk in completion:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield sse_event({"delta": chunk.choices[0].delta.content})
+            answer_cache.set(cache_key, "".join(parts))
+            yield sse_event({"done": True, "status": "success"})
+        except Exception as e:
+            yield sse_event({"done": True, "status": "error", "error": str(e)})
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """
@@ -226,29 +831,28 @@ async def chat(request: ChatRequest):
     """
     try:
         # 检查数据库中是否有内容
-        count = collection.count()
+        count = await count_cache.get()
         
         if count == 0:
             # 数据库为空，返回简单响应
             response_text = f"收到您的消息：{request.message}\n\n💡 提示：目前还没有记忆任何页面。点击「Memorize This Page」按钮来保存页面内容。"
-            return ChatResponse(
-                response=response_text,
-                status="success"
-            )
+            return chat_reply(request, response_text, "success")
         
-        # 使用 RAG 检索 Top 5 最相关的文本块
-        results = collection.query(
-            query_texts=[request.message],
-            n_results=min(15, count)
+        # 使用 RAG 召回候选文本块
+        query_embedding = await asyncio.to_thread(embed_query, request.message)
+        results = await asyncio.to_thread(
+            collection.query,
+            query_embeddings=[list(query_embedding)],
+            n_results=min(RETRIEVE_CANDIDATES, count)
         )
         
         # 检查是否找到相关内容
         if not results or not results['documents'] or len(results['documents'][0]) == 0:
             response_text = f"收到您的消息：{request.message}\n\n未找到相关的页面内容。"
-            return ChatResponse(
-                response=response_text,
-                status="success"
-            )
+            return chat_reply(request, response_text, "success")
+        
+        # 重排序，只保留 Top 5 最相关的文本块
+        results = await asyncio.to_thread(rerank_results, request.message, results)
         
         # 构建上下文
         context_snippets = []
@@ -274,58 +878,54 @@ Be concise and accurate."""
 
 Question: {request.message}"""
                 
+                # 相同问题且检索结果相同时直接返回缓存的回答
+                model = get_llm_model()
+                cache_key = AnswerCache.key("chat", model, request.message, results['ids'][0])
+                cached_response = answer_cache.get(cache_key)
+                if cached_response is not None:
+                    return chat_reply(request, cached_response, "success")
+                
                 # 调用 LLM API
-                completion = llm_client.chat.completions.create(
-                    model=get_llm_model(),
+                completion = await llm_client.chat.completions.create(
+                    model=model,
                     messages=[
                         {"role": "system", "content": system_prompt},
                         {"role": "user", "content": user_message}
                     ],
                     temperature=0.7,
-                    max_tokens=500
+                    max_tokens=500,
+                    stream=request.stream
                 )
                 
+                if request.stream:
+                    return stream_completion(completion, cache_key)
+                
                 # 提取 LLM 回答
                 llm_response = completion.choices[0].message.content
+                answer_cache.set(cache_key, llm_response)
                 
-                return ChatResponse(
-                    response=llm_response,
-                    status="success"
-                )
+                return chat_reply(request, llm_response, "success")
                 
             except Exception as llm_error:
                 # LLM 调用失败，降级为基础文本检索
-                fallback_response = f"⚠️ LLM 服务暂时不可用，为您展示相关片段：\n\n"
-                for i, (doc, metadata) in enumerate(zip(results['documents'][0], results['metadatas'][0]), 1):
-                    title = metadata.get('title', '未知标题')
-                    snippet = doc[:150] + "..." if len(doc) > 150 else doc
-                    fallback_response += f"📄 {i}. {title}\n{snippet}\n\n"
-                
-                fallback_response += f"\n🔧 错误详情: {str(llm_error)}"
-                
-                return ChatResponse(
-                    response=fallback_response,
-                    status="fallback"
+                fallback_response = (
+                    f"⚠️ LLM 服务暂时不可用，为您展示相关片段：\n\n"
+                    + format_snippets(results['documents'][0], results['metadatas'][0])
+                    + f"\n🔧 错误详情: {str(llm_error)}"
                 )
+                
+                return chat_reply(request, fallback_response, "fallback")
         else:
             # LLM 客户端未配置，返回基础文本检索结果
-            response_text = f"💡 提示：请配置 LLM API Key 以获得智能问答功能。\n\n根据您的问题「{request.message}」，找到以下相关内容：\n\n"
-            
-            for i, (doc, metadata) in enumerate(zip(results['documents'][0], results['metadatas'][0]), 1):
-                title = metadata.get('title', '未知标题')
-                snippet = doc[:150] + "..." if len(doc) > 150 else doc
-                response_text += f"📄 {i}. {title}\n{snippet}\n\n"
-            
-            return ChatResponse(
-                response=response_text,
-                status="success"
+            response_text = (
+                f"💡 提示：请配置 LLM API Key 以获得智能问答功能。\n\n根据您的问题「{request.message}」，找到以下相关内容：\n\n"
+                + format_snippets(results['documents'][0], results['metadatas'][0])
             )
+            
+            return chat_reply(request, response_text, "success")
     
     except Exception as e:
-        return ChatResponse(
-            response=f"处理消息时出错: {str(e)}",
-            status="error"
-        )
+        return chat_reply(request, f"处理消息时出错: {str(e)}", "error")
 
 @app.post("/chat-free", response_model=ChatResponse)
 async def chat_free(request: ChatRequest):
@@ -342,19 +942,19 @@ async def chat_free(request: ChatRequest):
         llm_client = get_llm_client()
         
         if not llm_client:
-            return ChatResponse(
-                response="⚠️ LLM未配置，请在桌面客户端设置中配置API Key",
-                status="error"
-            )
+            return chat_reply(request, "⚠️ LLM未配置，请在桌面客户端设置中配置API Key", "error")
         
         # 检查数据库中是否有内容
-        count = collection.count()
+        count = await count_cache.get()
         context = ""
+        doc_ids = []
         
         if count > 0:
             # 检索相关内容作为参考
-            results = collection.query(
-                query_texts=[request.message],
+            query_embedding = await asyncio.to_thread(embed_query, request.message)
+            results = await asyncio.to_thread(
+                collection.query,
+                query_embeddings=[list(query_embedding)],
                 n_results=min(5, count)
             )
             
@@ -364,6 +964,14 @@ async def chat_free(request: ChatRequest):
                     title = metadata.get('title', '未知标题')
                     context_snippets.append(f"[参考 {i} - {title}]\n{doc}")
                 context = "\n\n".join(context_snippets)
+                doc_ids = results['ids'][0]
+        
+        # 相同问题且参考资料相同时直接返回缓存的回答
+        model = get_llm_model()
+        cache_key = AnswerCache.key("chat-free", model, request.message, doc_ids)
+        cached_response = answer_cache.get(cache_key)
+        if cached_response is not None:
+            return chat_reply(request, cached_response, "success")
         
         # 构建自由模式的系统提示
         system_prompt = """You are a helpful and knowledgeable assistant. 
@@ -382,28 +990,27 @@ Be helpful, accurate, and engaging."""
             user_message = request.message
         
         # 调用 LLM API  
-        completion = llm_client.chat.completions.create(
-            model=get_llm_model(),
+        completion = await llm_client.chat.completions.create(
+            model=model,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_message}
             ],
             temperature=0.7,
-            max_tokens=800
+            max_tokens=800,
+            stream=request.stream
         )
         
+        if request.stream:
+            return stream_completion(completion, cache_key)
+        
         llm_response = completion.choices[0].message.content
+        answer_cache.set(cache_key, llm_response)
         
-        return ChatResponse(
-            response=llm_response,
-            status="success"
-        )
+        return chat_reply(request, llm_response, "success")
     
     except Exception as e:
-        return ChatResponse(
-            response=f"处理消息时出错: {str(e)}",
-            status="error"
-        )
+        return chat_reply(request, f"处理消息时出错: {str(e)}", "error")
 
 
 @app.get("/pages")
@@ -415,31 +1022,8 @@ async def get_all_pages():
         包含页面列表的响应
     """
     try:
-        # 获取所有文档
-        results = collection.get()
-        
-        if not results or not results['documents']:
-            return {"pages": [], "total": 0}
-        
-        # 按source_id分组统计
-        pages_dict = {}
-        for i, (doc, metadata) in enumerate(zip(results['documents'], results['metadatas'])):
-            source_id = metadata.get('source_id', 'unknown')
-            
-            if source_id not in pages_dict:
-                pages_dict[source_id] = {
-                    'id': source_id,
-                    'title': metadata.get('title', '未知标题'),
-                    'timestamp': metadata.get('timestamp', ''),
-                    'chunks': 1,
-                    'preview': doc[:200] if doc else ''
-                }
-            else:
-                pages_dict[source_id]['chunks'] += 1
-        
-        # 转换为列表并按时间排序
-        pages = list(pages_dict.values())
-        pages.sort(key=lambda x: x['timestamp'], reverse=True)
+        # 从页面索引读取（已按时间排序）
+        pages = await asyncio.to_thread(list_indexed_pages)
         
         return {
             "pages": pages,
@@ -466,7 +1050,8 @@ async def get_page_detail(page_id: str):
     """
     try:
         # 查询该source_id的所有chunks
-        results = collection.get(
+        results = await asyncio.to_thread(
+            collection.get,
             where={"source_id": page_id}
         )
         
@@ -483,7 +1068,7 @@ async def get_page_detail(page_id: str):
         return {
             "id": page_id,
             "title": metadata.get('title', '未知标题'),
-            "timestamp": metadata.get('timestamp', ''),
+            "timestamp": format_timestamp(metadata.get('timestamp', '')),
             "chunks": len(results['documents']),
             "content": content
         }
@@ -521,6 +1106,7 @@ async def save_settings(settings: SettingsRequest):
             "base_url": settings.base_url,
             "model": settings.model
         })
+        invalidate_llm_config()
         return {
             "status": "success",
             "message": "设置已保存，请重启应用以生效"
@@ -548,6 +1134,7 @@ async def save_api_configs(data: dict):
     """保存所有API配置"""
     try:
         write_all_configs(data)
+        invalidate_llm_config()
         return {
             "status": "success",
             "message": "配置已保存"
@@ -561,5 +1148,23 @@ async def save_api_configs(data: dict):
 
 if __name__ == "__main__":
     import uvicorn
-    # 启动服务器
-    uvicorn.run(app, host="127.0.0.1", port=8000, reload=True)
+    
+    # 开发时设置 RELOAD=1 启用热重载（热重载与多进程互斥）
+    reload = os.getenv("RELOAD") == "1"
+    workers = int(os.getenv("WORKERS", "1"))
+    if workers > 1 and not os.getenv("CHROMA_HOST"):
+        # PersistentClient 不支持多进程同时读写同一目录
+        print("⚠️ 多进程模式需要设置 CHROMA_HOST 连接 Chroma 服务端，已回退为单进程")
+        workers = 1
+    
+    # 启动服务器（uvloop 事件循环 + httptools 解析器，均随 uvicorn[standard] 安装；Windows 不支持 uvloop）
+    # 热重载与多进程需要由 uvicorn 按导入字符串加载应用；单进程直接传入 app，避免本模块被再次导入
+    uvicorn.run(
+        "main:app" if reload or workers > 1 else app,
+        host="127.0.0.1",
+        port=8000,
+        reload=reload,
+        workers=None if reload else workers,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools"
+    )
@@ -2,137 +2,453 @@
 ChromaDB 集成验证脚本
 验证后端的记忆功能和RAG检索功能
 """
-import requests
-import json
+import argparse
+import asyncio
+import atexit
+import contextlib
+import gzip
+import io
+import logging
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import httpx
+import orjson
+import os
 
 API_BASE_URL = "http://localhost:8000"
 
-def test_root():
-    """测试根端点 - 检查API状态"""
-    print("=" * 50)
-    print("测试 1: API 健康检查")
-    print("=" * 50)
+# 接口路径 - 由客户端的 base_url 统一拼接
+URL_ROOT, URL_MEM, URL_MEM_BATCH, URL_CHAT = "/", "/memorize", "/memorize-batch", "/chat"
+
+class StdoutHandler(logging.StreamHandler):
+    """始终写入当前的 sys.stdout，使 buffered_stdout 的重定向对日志同样生效"""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+# 诊断输出走 logging：默认 WARNING 只显示失败；LOGLEVEL=INFO 显示过程，LOGLEVEL=DEBUG 另外输出完整 JSON 响应
+log = logging.getLogger("backend_test")
+log.addHandler(StdoutHandler())
+log.setLevel(os.environ.get("LOGLEVEL", "WARNING").upper())
+log.propagate = False
+
+# 连接池配置（同步与异步客户端共用）；本地 uvicorn 只支持 HTTP/1.1，依靠 keep-alive 复用连接
+LIMITS = httpx.Limits(max_keepalive_connections=8, max_connections=16)
+
+# 复用同一个长连接客户端：keep-alive 连接在所有请求之间复用
+CLIENT = httpx.Client(
+    base_url=API_BASE_URL,
+    transport=httpx.HTTPTransport(limits=LIMITS),
+    timeout=30.0
+)
+atexit.register(CLIENT.close)
+
+def new_async_client():
+    """创建并发阶段共用的异步客户端"""
+    return httpx.AsyncClient(
+        base_url=API_BASE_URL,
+        transport=httpx.AsyncHTTPTransport(limits=LIMITS),
+        timeout=30.0
+    )
+
+BAR = "=" * 50 + "\n"
+
+# 横幅在导入时按 stdout 的编码预先编码成字节，输出时直接写入底层缓冲区，跳过逐次的文本编码
+BANNERS = {
+    title: f"{BAR}{title}\n{BAR}".encode(sys.stdout.encoding or "utf-8", errors="replace")
+    for title in (
+        "测试 1: API 健康检查",
+        "测试 2: 记忆页面内容",
+        "测试 3: 记忆多个页面",
+        "测试 4: RAG 聊天检索",
+        "语义相似度校验",
+        "最终状态检查",
+    )
+}
+
+def banner(title):
+    """输出测试标题横幅（与其他诊断信息一样，仅在 INFO 级别及以下显示）"""
+    if not log.isEnabledFor(logging.INFO):
+        return
+    raw = getattr(sys.stdout, "buffer", None)
+    if raw is None or title not in BANNERS:
+        log.info(f"{BAR}{title}\n{BAR.rstrip()}")
+        return
+    # 先刷新文本层保证输出顺序，再把预编码的字节写入缓冲区（由 buffered_stdout 合并刷新）
+    sys.stdout.flush()
+    raw.write(BANNERS[title])
+
+@contextlib.contextmanager
+def buffered_stdout(buffer_size=65536):
+    """输出重定向到文件/管道时，合并块内所有 stdout 写入，退出时一次性刷新"""
+    if sys.stdout.isatty():
+        yield
+        return
     
-    response = requests.get(f"{API_BASE_URL}/")
-    print(f"状态码: {response.status_code}")
-    print(f"响应: {json.dumps(response.json(), indent=2, ensure_ascii=False)}")
-    print()
+    sys.stdout.flush()
+    writer = io.BufferedWriter(sys.stdout.buffer, buffer_size=buffer_size)
+    out = io.TextIOWrapper(writer, encoding=sys.stdout.encoding, errors=sys.stdout.errors)
+    try:
+        with contextlib.redirect_stdout(out):
+            yield
+    finally:
+        # 刷新后解除包装，保留原始的 sys.stdout.buffer
+        out.detach().detach()
 
-def test_memorize():
-    """测试记忆端点 - 存储页面内容"""
-    print("=" * 50)
-    print("测试 2: 记忆页面内容")
-    print("=" * 50)
-    
-    # 测试数据 - 模拟维基百科AI页面
-    test_data = {
-        "title": "Artificial Intelligence - Wikipedia",
-        "content": """Artificial intelligence (AI) is intelligence demonstrated by machines, 
+def jparse(response):
+    """用 orjson 解析响应体"""
+    return orjson.loads(response.content)
+
+def check_response(response):
+    """非 200 响应时抛出带状态码与响应体的错误，而不是在按字段取值时得到含糊的 KeyError"""
+    if response.status_code != 200:
+        raise RuntimeError(
+            f"{response.request.method} {response.request.url.path} 返回 HTTP {response.status_code}: "
+            f"{response.text[:200]}"
+        )
+    return response
+
+def pp(response):
+    """将响应体格式化为缩进 JSON（直接解析原始字节，中文不转义）"""
+    return orjson.dumps(response.content and jparse(response), option=orjson.OPT_INDENT_2).decode()
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# 超过该大小的请求体使用 gzip 压缩后发送
+GZIP_MIN_BYTES = 512
+GZIP_HEADERS = {**JSON_HEADERS, "Content-Encoding": "gzip"}
+
+# 不支持 gzip 请求体的后端会把压缩数据当作 JSON 解析，返回 422（或 400/415）
+GZIP_REJECTED = frozenset((400, 415, 422))
+
+async def gzpost(client, path, body):
+    """POST 已序列化的 JSON 字节；较大的请求体先以最快级别 gzip 压缩，后端不接受压缩时回退为原文"""
+    if len(body) > GZIP_MIN_BYTES:
+        response = await client.post(path, content=gzip.compress(body, compresslevel=1), headers=GZIP_HEADERS)
+        if response.status_code not in GZIP_REJECTED:
+            return response
+    return await client.post(path, content=body, headers=JSON_HEADERS)
+
+async def _post(client, path, payload):
+    """异步 POST 请求（payload 可为 dict 或已序列化的字节），返回解析后的 JSON"""
+    if isinstance(payload, bytes):
+        response = await gzpost(client, path, payload)
+    else:
+        response = await client.post(path, json=payload)
+    return jparse(check_response(response))
+
+# RAG 测试问题及预先序列化好的流式请求体（循环中直接发送字节，无需逐次编码）
+QUERIES = tuple(
+    (query, orjson.dumps({"message": query, "stream": True}))
+    for query in (
+        "What is artificial intelligence?",
+        "Tell me about machine learning",
+        "How do neural networks work?"
+    )
+)
+
+@dataclass(slots=True, frozen=True)
+class Page:
+    """测试页面；请求体在创建时序列化一次，之后直接发送字节"""
+    title: str
+    content: str
+    serialized: bytes = field(init=False, repr=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "serialized", orjson.dumps({"title": self.title, "content": self.content}))
+
+# 测试数据 - 模拟维基百科页面（第 1 页用于单页测试，其余用于批量测试）
+TEST_PAGES: tuple[Page, ...] = (
+    Page(
+        title="Artificial Intelligence - Wikipedia",
+        content="""Artificial intelligence (AI) is intelligence demonstrated by machines, 
         as opposed to natural intelligence displayed by animals including humans. 
         AI research has been defined as the field of study of intelligent agents, 
         which refers to any system that perceives its environment and takes actions 
         that maximize its chance of achieving its goals. The term artificial intelligence 
         is often used to describe machines that mimic cognitive functions that humans 
         associate with the human mind, such as learning and problem solving."""
-    }
-    
-    response = requests.post(
-        f"{API_BASE_URL}/memorize",
-        json=test_data
-    )
-    
-    print(f"状态码: {response.status_code}")
-    result = response.json()
-    print(f"响应: {json.dumps(result, indent=2, ensure_ascii=False)}")
-    print()
-    return result
-
-def test_memorize_multiple():
-    """测试存储多个页面"""
-    print("=" * 50)
-    print("测试 3: 记忆多个页面")
-    print("=" * 50)
-    
-    pages = [
-        {
-            "title": "Machine Learning - Wikipedia",
-            "content": """Machine learning is a subset of artificial intelligence that 
+    ),
+    Page(
+        title="Machine Learning - Wikipedia",
+        content="""Machine learning is a subset of artificial intelligence that 
             focuses on the use of data and algorithms to imitate the way that humans learn, 
             gradually improving its accuracy. Machine learning is an important component 
             of the growing field of data science."""
-        },
-        {
-            "title": "Neural Networks - Wikipedia",
-            "content": """A neural network is a series of algorithms that endeavors to recognize 
+    ),
+    Page(
+        title="Neural Networks - Wikipedia",
+        content="""A neural network is a series of algorithms that endeavors to recognize 
             underlying relationships in a set of data through a process that mimics the way 
             the human brain operates. In this sense, neural networks refer to systems of neurons, 
             either organic or artificial in nature."""
-        }
-    ]
-    
-    for i, page in enumerate(pages, 1):
-        response = requests.post(f"{API_BASE_URL}/memorize", json=page)
-        result = response.json()
-        print(f"页面 {i}: {result['title']}")
-        print(f"  状态: {result['status']}")
-        print(f"  文档ID: {result['doc_id']}")
-        print()
-
-def test_chat_rag():
-    """测试RAG增强的聊天"""
-    print("=" * 50)
-    print("测试 4: RAG 聊天检索")
-    print("=" * 50)
-    
-    queries = [
-        "What is artificial intelligence?",
-        "Tell me about machine learning",
-        "How do neural networks work?"
-    ]
+    ),
+)
+
+# 各测试问题的参考答案（与 QUERIES 一一对应，取对应页面的正文），供 --eval 做语义相似度校验
+EXPECTED_ANSWERS = tuple(" ".join(page.content.split()) for page in TEST_PAGES)
+
+def assert_similar(queries, expected, threshold=0.8):
+    """
+    批量校验回答与参考答案的语义相似度（整批编码一次，再一次性计算逐对余弦相似度）
     
-    for query in queries:
-        print(f"\n问题: {query}")
-        print("-" * 40)
-        
-        response = requests.post(
-            f"{API_BASE_URL}/chat",
-            json={"message": query}
-        )
-        
-        result = response.json()
-        print(f"回答:\n{result['response']}")
-        print()
+    Args:
+        queries: 待校验的回答文本列表
+        expected: 与之一一对应的参考答案列表
+        threshold: 相似度下限，任一对低于此值即断言失败
+    """
+    # 仅在 --eval 时需要，延迟导入；使用与后端相同的 MiniLM 嵌入模型
+    import numpy as np
+    from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+    
+    embed = DefaultEmbeddingFunction()
+    Q = np.asarray(embed(list(queries)), dtype=np.float32)
+    E = np.asarray(embed(list(expected)), dtype=np.float32)
+    Q /= np.linalg.norm(Q, axis=1, keepdims=True)
+    E /= np.linalg.norm(E, axis=1, keepdims=True)
+    sims = np.einsum('ij,ij->i', Q, E)
+    
+    log.info("语义相似度: " + ", ".join(f"{sim:.3f}" for sim in sims))
+    low = [f"#{i} ({sim:.3f})" for i, sim in enumerate(sims, 1) if sim <= threshold]
+    if low:
+        # 显式抛出，python -O 下同样生效
+        raise AssertionError(f"回答与参考答案的相似度低于 {threshold}: {', '.join(low)}")
+    return sims
 
-def main():
-    print("\n🧪 ChromaDB RAG 功能验证测试\n")
+# 客户端问答缓存：规范化后的问题 -> 回答，重复提问不再请求后端
+class ChatCache:
+    """LRU 缓存，超过 maxsize 时淘汰最久未使用的回答"""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key):
+        answer = self._data.get(key)
+        if answer is not None:
+            self._data.move_to_end(key)
+        return answer
+
+    def set(self, key, answer):
+        self._data[key] = answer
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+_chat_cache = ChatCache()
+
+def normalize_message(message):
+    """规范化问题文本（忽略大小写与多余空白）作为缓存键"""
+    return " ".join(message.lower().split())
+
+async def _chat_stream(client, payload):
+    """
+    以 SSE 流式请求 /chat，边接收边拼接回答
     
-    try:
-        # 测试 1: API 健康检查
-        test_root()
+    Args:
+        payload: 已序列化的 JSON 请求体（需包含 "stream": true）
+    
+    Returns:
+        (回答文本, 首个片段到达耗时秒数, 最终状态, 错误信息)
+    """
+    parts = []
+    first_token = None
+    status, error = "error", "响应流在结束事件之前中断"
+    start = time.perf_counter()
+    async with client.stream("POST", URL_CHAT, content=payload, headers=JSON_HEADERS) as response:
+        if response.status_code != 200:
+            body = (await response.aread()).decode(errors="replace")
+            return "", None, "error", f"HTTP {response.status_code}: {body[:200]}"
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = orjson.loads(line[6:])
+            if "delta" in event:
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                parts.append(event["delta"])
+            if event.get("done"):
+                # 结束事件携带最终状态；后端中途出错时为 {"status": "error", "error": ...}
+                status, error = event.get("status", "success"), event.get("error")
+    return "".join(parts), first_token, status, error
+
+async def _chat(client, message, payload=None):
+    """
+    发送 /chat 请求，相同问题直接命中缓存
+    
+    Args:
+        message: 问题文本
+        payload: 预先序列化的请求体，省略时按 message 现场编码
+    
+    Returns:
+        (回答文本, 首个片段到达耗时秒数（命中缓存时为 None）, 最终状态, 错误信息)
+    """
+    key = normalize_message(message)
+    cached = _chat_cache.get(key)
+    if cached is not None:
+        return cached, None, "success", None
+    if payload is None:
+        payload = orjson.dumps({"message": message, "stream": True})
+    answer, first_token, status, error = await _chat_stream(client, payload)
+    if status == "success":
+        # 只缓存成功的回答，出错后重问仍会请求后端
+        _chat_cache.set(key, answer)
+    return answer, first_token, status, error
+
+async def _get(client, path):
+    """异步 GET 请求，返回解析后的 JSON"""
+    response = await client.get(path)
+    return jparse(check_response(response))
+
+def wait_until_ready(tries=5, backoff=0.05):
+    """
+    启动前探测后端是否就绪（两次尝试之间指数退避：0.05、0.1、0.2、0.4 秒）
+    
+    Returns:
+        就绪时返回根端点的响应；始终无法连接或一直返回 5xx 时返回 None
+    """
+    status = None
+    for attempt in range(tries):
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        try:
+            response = CLIENT.get(URL_ROOT, timeout=httpx.Timeout(3.0, connect=1.0))
+        except httpx.TransportError:
+            continue
+        if response.status_code < 500:
+            return response
+        status = response.status_code
+    if status is not None:
+        log.warning(f"后端持续返回 HTTP {status}")
+    return None
+
+def test_root(response):
+    """测试根端点 - 检查API状态（使用就绪探测的响应）"""
+    banner("测试 1: API 健康检查")
+    
+    log.info(f"状态码: {response.status_code}\n")
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(f"响应: {pp(response)}\n")
+
+async def test_memorize(client):
+    """测试记忆端点 - 存储页面内容"""
+    response = await gzpost(client, URL_MEM, TEST_PAGES[0].serialized)
+    
+    # 与测试 3 并发执行，请求完成后再整段输出，避免交错
+    banner("测试 2: 记忆页面内容")
+    log.info(f"状态码: {response.status_code}\n")
+    result = jparse(check_response(response))
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(f"响应: {pp(response)}\n")
+    if result['status'] != "success":
+        log.warning(f"页面存储失败: {result['title']} - {result['message']}")
+    return result
+
+async def test_memorize_multiple(client):
+    """测试存储多个页面（一次批量请求）"""
+    pages = TEST_PAGES[1:]
+    
+    # 直接拼接各页面已序列化的请求体
+    payload = b'{"pages":[' + b",".join(page.serialized for page in pages) + b"]}"
+    response = await gzpost(client, URL_MEM_BATCH, payload)
+    if response.status_code == 404:
+        # 旧版后端没有批量端点，回退为逐页并发提交
+        results = await asyncio.gather(*[_post(client, URL_MEM, page.serialized) for page in pages])
+    else:
+        results = jparse(check_response(response))["results"]
+    
+    banner("测试 3: 记忆多个页面")
+    for i, result in enumerate(results, 1):
+        log.info(f"页面 {i}: {result['title']}\n  状态: {result['status']}\n  文档ID: {result['doc_id']}\n")
+        if result['status'] != "success":
+            log.warning(f"页面存储失败: {result['title']} - {result['message']}")
+    
+    return sum(result['status'] == "success" for result in results)
+
+async def test_chat_rag(client):
+    """测试RAG增强的聊天（并发查询）"""
+    banner("测试 4: RAG 聊天检索")
+    
+    answers = await asyncio.gather(*[_chat(client, query, payload) for query, payload in QUERIES])
+    
+    for (query, _), (answer, first_token, status, error) in zip(QUERIES, answers):
+        latency = f"首个片段耗时: {first_token * 1000:.0f} ms\n" if first_token is not None else ""
+        log.info(f"\n问题: {query}\n{'-' * 40}\n{latency}回答:\n{answer}\n")
+        if status != "success":
+            log.warning(f"回答状态为 {status}: {query}" + (f" - {error}" if error else ""))
+        elif not answer:
+            log.warning(f"未收到回答: {query}")
+    
+    return [answer for answer, *_ in answers]
+
+async def main_async(root_response, verify=False, threshold=None):
+    # 并发阶段共享同一个异步客户端，避免每次请求重建连接
+    async with new_async_client() as client:
+        # 阶段 A - 测试 1: API 健康检查（输出就绪探测已取得的响应），随后预热异步客户端的连接
+        test_root(root_response)
+        await client.get(URL_ROOT)
         
-        # 测试 2: 记忆单个页面
-        test_memorize()
+        # 阶段 B - 测试 2、3: 记忆单个页面与多个页面，互不依赖，并发执行
+        single, multiple = await asyncio.gather(test_memorize(client), test_memorize_multiple(client))
+        posted = int(single['status'] == "success") + multiple
         
-        # 测试 3: 记忆多个页面
-        test_memorize_multiple()
+        # 阶段 C - 测试 4: RAG 检索测试（依赖阶段 B 写入的数据）
+        answers = await test_chat_rag(client)
         
-        # 测试 4: RAG 检索测试
-        test_chat_rag()
+        # --eval: 所有回答收齐后整批做一次语义相似度校验
+        if threshold is not None:
+            banner("语义相似度校验")
+            await asyncio.to_thread(assert_similar, answers, EXPECTED_ANSWERS, threshold)
         
-        # 最终状态检查
-        print("=" * 50)
-        print("最终状态检查")
-        print("=" * 50)
-        response = requests.get(f"{API_BASE_URL}/")
-        print(f"总共存储的页面数: {response.json()['stored_pages']}")
+        # 最终状态检查（默认使用客户端统计的结果，--verify 时向服务端确认）
+        banner("最终状态检查")
+        log.info(f"本次存储的页面数 (client-side): {posted}")
+        if verify:
+            result = await _get(client, URL_ROOT)
+            log.info(f"总共存储的文本块数 (server-side): {result['stored_pages']}")
+
+def print_connection_error():
+    """提示后端服务未启动"""
+    log.error(
+        "❌ 错误: 无法连接到后端服务\n"
+        "   请确保后端服务正在运行: python -m uvicorn backend.main:app --reload --host 127.0.0.1 --port 8000"
+    )
+
+def main():
+    """运行全部测试；返回进程退出码（任一测试失败或无法连接时为 1，供 CI 判断）"""
+    parser = argparse.ArgumentParser(description="ChromaDB RAG 功能验证测试")
+    parser.add_argument("--verify", action="store_true", help="结束时向服务端查询存储总数")
+    parser.add_argument("--eval", nargs="?", type=float, const=0.8, default=None, metavar="THRESHOLD",
+                        help="校验回答与参考答案的语义相似度（默认阈值 0.8，需要 numpy 与 chromadb）")
+    args = parser.parse_args()
+    
+    log.info("\n🧪 ChromaDB RAG 功能验证测试\n")
+    
+    # 只探测一次：后端未就绪时直接退出，不再逐个尝试后续测试
+    root_response = wait_until_ready()
+    if root_response is None:
+        print_connection_error()
+        return 1
+    
+    try:
+        with buffered_stdout():
+            asyncio.run(main_async(root_response, verify=args.verify, threshold=args.eval))
         
         print("\n✅ 所有测试完成！")
+        return 0
         
-    except requests.exceptions.ConnectionError:
-        print("❌ 错误: 无法连接到后端服务")
-        print("   请确保后端服务正在运行: python -m uvicorn backend.main:app --reload --host 127.0.0.1 --port 8000")
+    except httpx.ConnectError:
+        print_connection_error()
     except Exception as e:
-        print(f"❌ 测试失败: {str(e)}")
+        log.error(f"❌ 测试失败: {str(e)}")
+    return 1
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())